@@ -0,0 +1,218 @@
+import numpy as np
+import pymupdf
+import cv2
+
+# These helpers live outside pdf_app.py so that worker processes can import
+# them. Streamlit runs pdf_app.py as a script, which a process pool cannot
+# pickle functions from.
+#
+# Pages stay as one RGB uint8 NumPy array from render to JPEG encode.
+
+# Width of the thumbnail used to measure skew angle
+SKEW_DETECT_WIDTH = 800
+
+# Skew search (degrees): a wide pass over +/- range on a half-size copy,
+# then coarse and fine steps around its best angle
+SKEW_SEARCH_RANGE = 45.0
+SKEW_WIDE_STEP = 1.0
+SKEW_COARSE_STEP = 0.5
+SKEW_FINE_STEP = 0.1
+
+# The best angle's profile must beat the unrotated one by this factor,
+# otherwise the page is left alone (no clear text lines to go by)
+SKEW_MIN_GAIN = 1.5
+
+# Smallest angle (degrees) worth rotating a page for. The strict value
+# skips pages whose measured skew is more likely noise than real tilt.
+MIN_SKEW_ANGLE = 0.5
+STRICT_MIN_SKEW_ANGLE = 0.75
+
+# Images covering more than this share of the page (all images added up,
+# since scanners may store a page as strips or tiles) make it a scan
+SCAN_IMAGE_COVERAGE = 0.5
+
+# Render resolution limits (see dpi_for_quality)
+MIN_DPI = 100
+MAX_DPI = 300
+
+# The PDF each worker process renders from (see open_document)
+_worker_doc = None
+
+# Full-page scratch arrays each worker reuses across pages (see get_buffer)
+_worker_buffers = {}
+
+# --- Helper: Reusable Page Buffer ---
+def get_buffer(name, shape):
+    """
+    Return this worker's scratch array for name, reallocating only when
+    the page size changes. Saves a fresh full-page allocation per page.
+    Contents are only valid until the next page reuses it.
+    """
+    buffer = _worker_buffers.get(name)
+    if buffer is None or buffer.shape != shape:
+        buffer = np.empty(shape, dtype=np.uint8)
+        _worker_buffers[name] = buffer
+    return buffer
+
+# --- Helper: Pick Render DPI ---
+def dpi_for_quality(quality):
+    """
+    Low JPEG quality throws away fine detail anyway, so there is no point
+    rendering it. 150 DPI at quality 50, rising to 300 DPI at quality 100.
+    """
+    dpi = int(150 + (quality - 50) * 3)
+    return max(MIN_DPI, min(MAX_DPI, dpi))
+
+# --- Helper: Born-Digital Check ---
+def is_born_digital(page):
+    """
+    Pages exported from Word/LaTeX etc. are never skewed, so deskew can be
+    skipped. They have real text and images cover little of the page;
+    scans (even OCR'd ones) are page images, whole or in strips/tiles.
+    """
+    if not page.get_text().strip():
+        return False
+
+    # Overlaps are counted twice, which only errs towards "scan" (deskew)
+    image_area = sum(
+        abs(pymupdf.Rect(image["bbox"]) & page.rect)
+        for image in page.get_image_info()
+    )
+    return image_area <= SCAN_IMAGE_COVERAGE * abs(page.rect)
+
+# --- Helper: Measure Skew ---
+def find_skew_angle(gray):
+    """
+    Projection-profile skew detection. When text lines are level, the
+    row sums of the ink jump sharply between lines and gaps, so try
+    rotations and keep the one with the sharpest row profile.
+    Returns the angle to rotate by, or None for a blank page or one with
+    no clear text lines.
+    """
+    # Ink = white on black, so each row sum counts text in that row
+    _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    if not ink.any():
+        return None
+
+    def profile_score(image, angle):
+        (h, w) = image.shape
+        M = cv2.getRotationMatrix2D((w // 2, h // 2), float(angle), 1.0)
+        rotated = cv2.warpAffine(image, M, (w, h), flags=cv2.INTER_NEAREST, borderValue=0)
+        rows = rotated.sum(axis=1, dtype=np.float64)
+        return np.sum(np.diff(rows) ** 2)
+
+    def best_angle(image, start, stop, step, around):
+        # Nearest-first, so ties keep the angle closest to the last guess
+        candidates = np.arange(start, stop + step / 2, step)
+        candidates = sorted(candidates, key=lambda a: abs(a - around))
+        return max(candidates, key=lambda a: profile_score(image, a))
+
+    # 1. Wide pass over the full range, cheap on a half-size copy
+    half = cv2.resize(ink, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+    best = best_angle(half, -SKEW_SEARCH_RANGE, SKEW_SEARCH_RANGE, SKEW_WIDE_STEP, 0.0)
+
+    # 2. Refine on the thumbnail: coarse, then fine
+    best = best_angle(ink, best - SKEW_WIDE_STEP, best + SKEW_WIDE_STEP, SKEW_COARSE_STEP, best)
+    best = best_angle(ink, best - SKEW_COARSE_STEP, best + SKEW_COARSE_STEP, SKEW_FINE_STEP, best)
+
+    # 3. Only trust it if it clearly beats leaving the page as it is
+    if profile_score(ink, best) < SKEW_MIN_GAIN * profile_score(ink, 0.0):
+        return None
+    return float(best)
+
+# --- Helper: Deskew ---
+def deskew_image(image, high_quality=False, min_angle=MIN_SKEW_ANGLE, out=None):
+    # Skew is the same at any scale, so measure it on a small copy.
+    # The angle search is the slowest step; this makes it several times faster.
+    (h, w) = image.shape[:2]
+    small = image
+    if w > SKEW_DETECT_WIDTH:
+        small_height = int(h * SKEW_DETECT_WIDTH / w)
+        small = cv2.resize(image, (SKEW_DETECT_WIDTH, small_height), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+    angle = find_skew_angle(gray)
+
+    # Most clean scans need no rotation: no full-size work at all
+    if angle is None or abs(angle) < min_angle:
+        return image
+
+    center = (w // 2, h // 2)
+    M = cv2.getRotationMatrix2D(center, angle, 1.0)
+
+    # Linear looks the same as cubic for small text rotations and is
+    # several times cheaper; cubic is kept as an opt-in.
+    interpolation = cv2.INTER_CUBIC if high_quality else cv2.INTER_LINEAR
+    # Writes into out (same shape as image) when given, instead of a new array
+    rotated = cv2.warpAffine(
+        image, M, (w, h), dst=out, flags=interpolation,
+        borderMode=cv2.BORDER_CONSTANT, borderValue=(255, 255, 255)
+    )
+    return rotated
+
+# --- Worker: Open the PDF once ---
+def open_document(input_pdf_path):
+    """
+    Process pool initializer. Parses the PDF once per worker instead of
+    once per page; process_page then renders from this open document.
+    """
+    global _worker_doc
+    _worker_doc = pymupdf.open(input_pdf_path)
+
+# --- Worker: Process ONE page ---
+def process_page(page_index, output_img_path, max_width, auto_straighten, quality,
+                 high_quality_rotation=False, optimize_huffman=False, min_skew_angle=MIN_SKEW_ANGLE):
+    """
+    Render, straighten and save a single page as JPEG.
+    Runs in a worker process set up by open_document, so it only takes
+    plain values and returns the saved path.
+    """
+    # 1. Read ONE page from the already-open PDF
+    # PyMuPDF renders in-process: no pdftoppm subprocess, no PPM pipe
+    page = _worker_doc[page_index]
+
+    # CRITICAL: Render straight at max_width (Crucial for RAM saving)
+    # Cheaper than rendering big and shrinking afterwards. Never goes
+    # above the quality-based DPI (Low quality = low DPI).
+    # Page size is in points (72 per inch), so zoom = DPI / 72.
+    zoom = min(dpi_for_quality(quality) / 72, max_width / page.rect.width)
+    pix = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom))
+
+    # Wrap the pixmap's RGB buffer directly (no copy)
+    page_img = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+
+    # 2. Deskew (Safe because image is already small)
+    # Born-digital pages are straight by construction; skip the search
+    if auto_straighten and not is_born_digital(page):
+        final_img = deskew_image(
+            page_img, high_quality=high_quality_rotation, min_angle=min_skew_angle,
+            out=get_buffer("rotated", page_img.shape),
+        )
+    else:
+        final_img = page_img
+
+    # 3. Save to Disk
+    # OpenCV encodes with libjpeg-turbo (SIMD), much faster than PIL.
+    # The second Huffman pass (optimize) is opt-in: it roughly doubles
+    # encode time for a few percent of file size.
+    # Colour is stored at half resolution (4:2:0); text edges live in
+    # brightness, so scans lose nothing visible and files get smaller.
+    bgr_img = cv2.cvtColor(final_img, cv2.COLOR_RGB2BGR, dst=get_buffer("bgr", final_img.shape))
+
+    ok, jpeg = cv2.imencode(".jpg", bgr_img, [
+        cv2.IMWRITE_JPEG_QUALITY, quality,
+        cv2.IMWRITE_JPEG_OPTIMIZE, int(optimize_huffman),
+        cv2.IMWRITE_JPEG_SAMPLING_FACTOR, cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420,
+    ])
+    if not ok:
+        raise RuntimeError(f"Could not encode page {page_index+1} as JPEG")
+    jpeg.tofile(output_img_path)
+
+    # 4. Cleanup
+    # Dropping the refs frees the buffers right away; no gc.collect()
+    # needed, there are no reference cycles here.
+    del page_img
+    del final_img
+    del bgr_img
+    del pix
+
+    return output_img_path
@@ -1,50 +1,85 @@
 import streamlit as st
-import numpy as np
 import img2pdf
-from pdf2image import convert_from_path, pdfinfo_from_path
-from deskew import determine_skew
-from PIL import Image
-import cv2
-import io
+import pymupdf
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import os
 import tempfile
-import gc
-import shutil
+
+from page_processing import open_document, process_page, MIN_SKEW_ANGLE, STRICT_MIN_SKEW_ANGLE
 
 # --- Page Config ---
 st.set_page_config(page_title="Emergency PDF Tool", layout="centered")
 
-# --- Helper: Resize Image (Crucial for RAM saving) ---
-def resize_image_if_too_big(pil_image, max_width=1500):
+# --- Processing (Cached) ---
+@st.cache_data(show_spinner=False, max_entries=4)
+def process_pdf(file_bytes, max_width_px, auto_straighten, quality,
+                high_quality_rotation, optimize_huffman, min_skew_angle):
     """
-    If image is wider than max_width, shrink it.
-    This prevents the server from running out of RAM.
+    Turn the uploaded PDF into the compressed PDF bytes.
+    Cached on (file contents, settings): clicking again with the same
+    settings is instant. max_entries keeps at most 4 results in RAM.
     """
-    width, height = pil_image.size
-    if width > max_width:
-        ratio = max_width / width
-        new_height = int(height * ratio)
-        return pil_image.resize((max_width, new_height), Image.LANCZOS)
-    return pil_image
+    # Created in here so Streamlit can replay them on a cache hit
+    progress_bar = st.progress(0)
+    status_text = st.empty()
 
-# --- Helper: Deskew ---
-def deskew_image(pil_image):
-    open_cv_image = np.array(pil_image)
-    gray = cv2.cvtColor(open_cv_image, cv2.COLOR_RGB2GRAY)
-    angle = determine_skew(gray)
-    
-    if angle is None or abs(angle) < 0.5:
-        return pil_image
+    # Create a Temporary Folder
+    with tempfile.TemporaryDirectory() as temp_dir:
+        
+        # 1. Save uploaded PDF to Disk first (Don't keep in RAM)
+        input_pdf_path = os.path.join(temp_dir, "input.pdf")
+        with open(input_pdf_path, "wb") as f:
+            f.write(file_bytes)
+        
+        # 2. Get Info from Disk
+        with pymupdf.open(input_pdf_path) as doc:
+            max_pages = doc.page_count
+        
+        status_text.text(f"Processing {max_pages} pages...")
+
+        # 3. Process pages in parallel (one page per worker)
+        # Each worker opens the PDF once and renders one page at a
+        # time, so RAM use grows with workers, not with pages.
+        saved_image_paths = [None] * max_pages
+        workers = min(os.cpu_count() or 1, max_pages)
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=open_document,
+            initargs=(input_pdf_path,),
+        ) as executor:
+            futures = {
+                executor.submit(
+                    process_page,
+                    i,
+                    os.path.join(temp_dir, f"page_{i}.jpg"),
+                    max_width_px,
+                    auto_straighten,
+                    quality,
+                    high_quality_rotation,
+                    optimize_huffman,
+                    min_skew_angle,
+                ): i
+                for i in range(max_pages)
+            }
+
+            # Pages finish out of order; keep them in page order
+            for done, future in enumerate(as_completed(futures), start=1):
+                saved_image_paths[futures[future]] = future.result()
+                progress = int((done / max_pages) * 90)
+                progress_bar.progress(progress)
+                status_text.text(f"Processed {done}/{max_pages} pages...")
+
+        # 4. Build PDF straight to Disk (Don't keep a 2nd copy in RAM)
+        status_text.text("Saving final PDF...")
+        output_pdf_path = os.path.join(temp_dir, "output.pdf")
+        with open(output_pdf_path, "wb") as f:
+            img2pdf.convert(saved_image_paths, outputstream=f)
+        
+        progress_bar.progress(100)
+        status_text.success("Done!")
 
-    (h, w) = open_cv_image.shape[:2]
-    center = (w // 2, h // 2)
-    M = cv2.getRotationMatrix2D(center, angle, 1.0)
-    
-    rotated = cv2.warpAffine(
-        open_cv_image, M, (w, h), flags=cv2.INTER_CUBIC, 
-        borderMode=cv2.BORDER_CONSTANT, borderValue=(255, 255, 255)
-    )
-    return Image.fromarray(rotated)
+        with open(output_pdf_path, "rb") as f:
+            return f.read()
 
 # --- UI ---
 
@@ -58,8 +93,16 @@ uploaded_file = st.file_uploader("Upload PDF file", type=["pdf"])
 st.write("---")
 st.subheader("Settings")
 auto_straighten = st.checkbox("Auto-Straighten", value=True)
+# Cubic rotation is slightly smoother but much slower
+high_quality_rotation = st.checkbox("High-Quality Straighten (Slower)", value=False)
+# Leave nearly-straight pages alone (saves a full-page rotation)
+strict_straighten = st.checkbox(f"Only Straighten Clearly Tilted Pages (> {STRICT_MIN_SKEW_ANGLE}°)", value=False)
+min_skew_angle = STRICT_MIN_SKEW_ANGLE if strict_straighten else MIN_SKEW_ANGLE
 # Lower quality saves disk space
 quality = st.slider("Compression Quality", 10, 95, 50) 
+st.caption("Quality also sets render resolution: 150 DPI at 50, up to 285 DPI at 95, at least 100 DPI.")
+# Extra encode pass, off by default for speed
+optimize_huffman = st.checkbox("Optimize Huffman tables (slower, ~4% smaller)", value=False)
 # Max Width Slider - The most important setting for crashes
 max_width_px = st.select_slider(
     "Max Page Width (Pixels)", 
@@ -72,86 +115,24 @@ if uploaded_file is not None:
     st.info(f"File: {uploaded_file.name}")
     
     if st.button("Start Processing"):
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
         try:
-            # Create a Temporary Folder
-            with tempfile.TemporaryDirectory() as temp_dir:
-                
-                # 1. Save uploaded PDF to Disk first (Don't keep in RAM)
-                input_pdf_path = os.path.join(temp_dir, "input.pdf")
-                with open(input_pdf_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-                
-                # 2. Get Info from Disk
-                info = pdfinfo_from_path(input_pdf_path)
-                max_pages = int(info["Pages"])
-                
-                status_text.text(f"Processing {max_pages} pages...")
-                saved_image_paths = []
-
-                for i in range(max_pages):
-                    # Progress
-                    progress = int(((i + 1) / max_pages) * 90)
-                    progress_bar.progress(progress)
-                    status_text.text(f"Processing Page {i+1}/{max_pages}...")
-                    
-                    # 3. Read ONE page from Disk
-                    # We use convert_from_path which is much better for memory
-                    page_images = convert_from_path(
-                        input_pdf_path,
-                        dpi=150, # Keep DPI low
-                        first_page=i+1, 
-                        last_page=i+1
-                    )
-                    
-                    if not page_images:
-                        continue
-                        
-                    pil_img = page_images[0]
-
-                    # 4. CRITICAL: Resize immediately!
-                    # This reduces the memory footprint by 70-90%
-                    pil_img = resize_image_if_too_big(pil_img, max_width=max_width_px)
-
-                    # 5. Deskew (Now safe because image is smaller)
-                    if auto_straighten:
-                        final_img = deskew_image(pil_img)
-                    else:
-                        final_img = pil_img
-
-                    # 6. Save to Disk
-                    output_img_path = os.path.join(temp_dir, f"page_{i}.jpg")
-                    
-                    if final_img.mode in ("RGBA", "P"):
-                        final_img = final_img.convert("RGB")
-                    
-                    final_img.save(output_img_path, format='JPEG', quality=quality, optimize=True)
-                    saved_image_paths.append(output_img_path)
-                    
-                    # 7. Cleanup
-                    del pil_img
-                    del final_img
-                    del page_images
-                    gc.collect()
-
-                # 8. Build PDF
-                status_text.text("Saving final PDF...")
-                final_pdf_bytes = img2pdf.convert(saved_image_paths)
-                
-                progress_bar.progress(100)
-                status_text.success("Done!")
-                
-                st.download_button(
-                    label="📥 Download Compressed PDF",
-                    data=final_pdf_bytes,
-                    file_name=f"Processed_{uploaded_file.name}",
-                    mime="application/pdf"
-                )
+            final_pdf_bytes = process_pdf(
+                uploaded_file.getvalue(),
+                max_width_px,
+                auto_straighten,
+                quality,
+                high_quality_rotation,
+                optimize_huffman,
+                min_skew_angle,
+            )
+            
+            st.download_button(
+                label="📥 Download Compressed PDF",
+                data=final_pdf_bytes,
+                file_name=f"Processed_{uploaded_file.name}",
+                mime="application/pdf"
+            )
 
         except Exception as e:
             st.error(f"Error: {e}")
-            if "poppler" in str(e).lower():
-                st.warning("System Error: Poppler missing.")
 